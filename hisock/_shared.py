@@ -9,7 +9,11 @@ Copyright SSS_Says_Snek, 2022-present
 from __future__ import annotations
 
 import inspect
+import queue
 import threading
+import traceback
+from collections import deque
+from functools import lru_cache
 from typing import Any, Callable, Optional, Union
 
 try:
@@ -24,6 +28,81 @@ except ImportError:
                        validate_command_not_reserved)
 
 
+def _is_catch_all_listener(listener: str) -> bool:
+    """Whether a :meth:`_HiSockBase.recv` listener is a catch-all one (``$<number>$``)"""
+    return listener.startswith("$") and listener.endswith("$") and listener[1:-1].isdigit()
+
+
+@lru_cache(maxsize=256)
+def _prepare_contentless_send(command: str, header_len: int) -> bytes:
+    """
+    Builds the message for a command without content. These never change, so
+    pings and other signals sent over and over are only built once.
+    """
+
+    data = b"$CMD$" + command.encode() + b"$MSG$" + make_header("", 8)
+    return make_header(data, header_len) + data
+
+
+class _HandlerThreads:
+    """
+    Runs functions with ``threaded=True``. Each call gets a daemon thread right
+    away, just like starting a new thread per call, but threads that finished a
+    call wait around for a few seconds to be reused instead of exiting.
+    There's no limit on the number of threads, so a blocking function can't hold
+    up other ones, and the threads won't keep the interpreter alive at exit.
+    """
+
+    IDLE_TIMEOUT = 5  # Seconds an idle thread waits for another call
+
+    def __init__(self):
+        self._calls = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        # Idle threads, minus the calls queued up for them
+        self._idle = 0
+
+    def submit(self, func: Callable, args: tuple, kwargs: dict):
+        """
+        Calls a function in a thread.
+
+        :param func: The function to call.
+        :type func: Callable
+        :param args: The arguments to pass to the function.
+        :type args: tuple
+        :param kwargs: The keyword arguments to pass to the function.
+        :type kwargs: dict
+        """
+
+        with self._lock:
+            if self._idle > 0:
+                self._idle -= 1
+                self._calls.put((func, args, kwargs))
+                return
+
+        threading.Thread(target=self._worker, args=((func, args, kwargs),), daemon=True).start()
+
+    def _worker(self, call: tuple[Callable, tuple, dict]):
+        while True:
+            func, args, kwargs = call
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+
+            with self._lock:
+                self._idle += 1
+            try:
+                call = self._calls.get(timeout=self.IDLE_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    # A call could've been queued for us right as we timed out
+                    try:
+                        call = self._calls.get_nowait()
+                    except queue.Empty:
+                        self._idle -= 1
+                        return
+
+
 class _HiSockBase:
     RECV_BUFFERSIZE = 8192
 
@@ -35,6 +114,8 @@ class _HiSockBase:
     def __init__(self, addr: tuple[str, int], header_len: int = 16, cache_size: int = -1):
         self.addr = addr
         self.header_len = header_len
+        # Same padding as `make_header`, with the header length bound once instead of per message
+        self._header_format = f"{{:<{header_len}}}".format
 
         # Function related storage
         # {"command": {"func": Callable, "name": str, "type_hint": {"arg": Any}, "threaded": bool, "override": bool}}
@@ -43,12 +124,16 @@ class _HiSockBase:
         # If catching all, then event_name will be a number sandwiched by dollar signs
         # Then `update` will handle the event with the lowest number
         self._recv_on_events: dict[str, Any] = {}
+        # Threads for functions with `threaded=True`
+        self._handler_threads = _HandlerThreads()
 
         # Cache
         self.cache_size = cache_size
-        # cache_size <= 0: No cache
-        if cache_size > 0:
-            self.cache = []
+        # cache_size < 0: No cache
+        # cache_size == 0: Unlimited cache
+        # Otherwise, the deque drops the oldest message once full
+        if cache_size >= 0:
+            self.cache: deque[MessageCacheMember] = deque(maxlen=cache_size or None)
 
         # Flags
         self.closed = False
@@ -64,7 +149,7 @@ class _HiSockBase:
         full_data: bytes,
         content_header: bytes,
     ):
-        if self.cache_size <= 0:
+        if self.cache_size < 0:
             return
 
         cache_content = content if has_listener else full_data
@@ -79,48 +164,8 @@ class _HiSockBase:
             )
         )
 
-        # Pop oldest from stack
-        if 0 < self.cache_size < len(self.cache):
-            self.cache.pop(0)
-
     # On decorator
 
-    def _call_wildcard_function(
-        self,
-        command: str,
-        content: Sendable,
-        client_info: Optional[ClientInfo] = None,
-    ):
-        """
-        Call the wildcard command.
-
-        :param command: The command that was sent. If None, then it is just
-            random data.
-        :type command: str, optional
-        :param content: The data to pass to the wildcard command. Will NOT be
-            type-casted.
-        :type content: bytes
-        :param client_info: The client info. If None, then there is no client info.
-        :type client_info: ClientInfo, optional
-
-        :raises FunctionNotFoundException: If there is no wildcard listener.
-        """
-
-        try:
-            self.funcs["*"]
-        except KeyError:
-            raise FunctionNotFoundException("A wildcard function doesn't exist.") from None
-
-        arguments = []
-        if client_info is not None:
-            arguments.append(client_info)
-        arguments.extend([command, content])
-
-        self._call_function(
-            "*",
-            *arguments,
-        )
-
     def _call_function_reserved(self, reserved_func_name: str, *args, **kwargs):
         """
         Call a reserved function. If the function is overridden or not found,
@@ -132,32 +177,20 @@ class _HiSockBase:
         :param kwargs: The keyword arguments to pass to the function.
         """
 
+        func = self.funcs.get(reserved_func_name)
         if (
             reserved_func_name not in self._reserved_funcs
-            or reserved_func_name not in self.funcs
+            or func is None
             # This shouldn't happen, because if it is overridden then it should already
             # be deleted from the reserved functions dictionary. But just in case the user
             # manually changed the dictionary or something...
-            or self.funcs[reserved_func_name]["override"]
+            or func["override"]
         ):
             return
 
         # Not going to verify if the amount of args and kwargs are correct, because
         # that should've already been done
-
-        # Normal
-        if not self.funcs[reserved_func_name]["threaded"]:
-            self.funcs[reserved_func_name]["func"](*args, **kwargs)
-            return
-
-        # Threaded
-        function_thread = threading.Thread(
-            target=self.funcs[reserved_func_name]["func"],
-            args=args,
-            kwargs=kwargs,
-            daemon=True,
-        )
-        function_thread.start()
+        self._call_handler(func, args, kwargs)
 
     def _call_function(self, func_name: str, *args, **kwargs):
         """
@@ -171,30 +204,71 @@ class _HiSockBase:
         :raises FunctionNotFoundException: If the function is not found.
         """
 
-        if func_name not in self.funcs:
+        func = self.funcs.get(func_name)
+        if func is None:
             raise FunctionNotFoundException(f"Function with command {func_name} not found")
 
+        self._call_handler(func, args, kwargs)
+
+    def _call_handler(self, func: dict, args: tuple, kwargs: dict):
+        """
+        Calls a function from :attr:`funcs` that was already looked up.
+
+        :param func: The entry of the function in :attr:`funcs`.
+        :type func: dict
+        :param args: The arguments to pass to the function.
+        :type args: tuple
+        :param kwargs: The keyword arguments to pass to the function.
+        :type kwargs: dict
+        """
+
         # Normal
-        if not self.funcs[func_name]["threaded"]:
-            self.funcs[func_name]["func"](*args, **kwargs)
+        if not func["threaded"]:
+            func["func"](*args, **kwargs)
             return
 
         # Threaded
-        function_thread = threading.Thread(
-            target=self.funcs[func_name]["func"],
-            args=args,
-            kwargs=kwargs,
-            daemon=True,
-        )
-        function_thread.start()
+        self._handler_threads.submit(func["func"], args, kwargs)
 
     def _prepare_send(self, command: str, content: Optional[Sendable] = None) -> bytes:
-        fmt, encoded_content = _typecast.write_fmt(content) if content is not None else ("", b"")
+        """
+        Builds the message to send for a command and its content.
 
-        data_to_send = b"$CMD$" + command.encode() + b"$MSG$" + make_header(fmt, 8) + fmt.encode() + encoded_content
-        data_header = make_header(data_to_send, self.header_len)
+        :param command: The command to send.
+        :type command: str
+        :param content: The content to send.
+        :type content: Sendable, optional
 
-        return data_header + data_to_send
+        :return: The header and data of the message.
+        :rtype: bytes
+        """
+
+        return b"".join(self._prepare_send_parts(command, content))
+
+    def _prepare_send_parts(self, command: str, content: Optional[Sendable] = None) -> tuple[bytes, ...]:
+        """
+        Builds the message to send for a command and its content, without copying the
+        content into it. For sending to one socket with :func:`_send_parts`.
+
+        :param command: The command to send.
+        :type command: str
+        :param content: The content to send.
+        :type content: Sendable, optional
+
+        :return: The parts that make up the header and data of the message, in order.
+        :rtype: tuple[bytes, ...]
+        """
+
+        if content is None:
+            return (_prepare_contentless_send(command, self.header_len),)
+
+        fmt, encoded_content = _typecast.write_fmt(content)
+        fmt = fmt.encode()
+
+        message_prefix = b"$CMD$" + command.encode() + b"$MSG$" + make_header(fmt, 8) + fmt
+        data_header = self._header_format(len(message_prefix) + len(encoded_content)).encode()
+
+        return data_header + message_prefix, encoded_content
 
     class _on:  # NOSONAR (it's used in child classes)
         """Decorator for handling a command"""
@@ -220,21 +294,21 @@ class _HiSockBase:
             :raises ValueError: If the number of function arguments is invalid.
             """
 
-            func_args = inspect.getfullargspec(func).args
+            num_args = len(inspect.getfullargspec(func).args)
 
             # Overriding a reserved command, remove it from reserved functions
             if self.override and self.command in self.outer._reserved_funcs:
                 self.outer.funcs.pop(self.command, None)
                 del self.outer._reserved_funcs[self.command]
 
-            self._assert_num_func_args_valid(len(func_args))
+            self._assert_num_func_args_valid(num_args)
 
             # Add function
             self.outer.funcs[self.command] = {
                 "func": func,
                 "name": func.__name__,
                 "threaded": self.threaded,
-                "num_args": len(func_args),
+                "num_args": num_args,
                 "override": self.override,
             }
 
@@ -284,23 +358,19 @@ class _HiSockBase:
         :rtype: bool
         """
 
-        for listener in self._recv_on_events:
+        # Specific listeners first, so a catch-all can't take a response someone is waiting for
+        if command in self._recv_on_events:
+            listener = command
+        else:
             # Catch-all listeners
             # `listener` transverses in-order, so the first will be the minimum
-            should_continue = True
-            if listener.startswith("$") and listener.endswith("$"):
-                should_continue = False
-            # Specific listeners
-            if listener == command:
-                should_continue = False
-            if should_continue:
-                continue
-
-            self._recv_on_events[listener]["data"] = content
-            self._recv_on_events[listener]["thread_event"].set()
-            return True
+            listener = next(filter(_is_catch_all_listener, self._recv_on_events), None)
+            if listener is None:
+                return False
 
-        return False
+        self._recv_on_events[listener]["data"] = content
+        self._recv_on_events[listener]["thread_event"].set()
+        return True
 
     def recv(self, recv_on: str = None) -> Sendable:
         """
@@ -327,18 +397,41 @@ class _HiSockBase:
             # Get the highest number of catch-all listeners
             catch_all_listener_max = 0
             for listener in self._recv_on_events:
-                if not listener.startswith("$") and listener.endswith("$"):
+                if not _is_catch_all_listener(listener):
                     continue
                 catch_all_listener_max = int(listener.replace("$", ""))
 
             listen_on = f"${catch_all_listener_max + 1}$"
 
+        self._add_recv_listener(listen_on)
+        return self._wait_recv(listen_on)
+
+    def _add_recv_listener(self, listen_on: str):
+        """
+        Starts listening for a command for :meth:`_wait_recv`. Listening before sending
+        a request means the response can't arrive before anyone is waiting for it.
+
+        :param listen_on: The command to listen on.
+        :type listen_on: str
+        """
+
         # {event_name: {"thread_event": threading.Event, "data": Union[None, bytes]}}
         self._recv_on_events[listen_on] = {
             "thread_event": threading.Event(),
             "data": None,
         }
 
+    def _wait_recv(self, listen_on: str) -> Sendable:
+        """
+        Waits for the data of a command added with :meth:`_add_recv_listener`.
+
+        :param listen_on: The command to wait for.
+        :type listen_on: str
+
+        :return: The data received, type casted.
+        :rtype: Sendable
+        """
+
         # Wait for `update` to retrieve the data
         self._recv_on_events[listen_on]["thread_event"].wait()
 
@@ -23,6 +23,9 @@ TYPE_TO_DECODE_FUNC = {
 TYPE_TO_FMT = {str: "s", int: "i", float: "f", bytes: "b"}
 CONTAINER_TO_FMT = {list: "l", tuple: "t", dict: "d"}
 
+# One lookup per primitive when encoding
+TYPE_TO_FMT_AND_ENCODE_FUNC = {type_: (TYPE_TO_FMT[type_], func) for type_, func in TYPE_TO_ENCODE_FUNC.items()}
+
 CONTAINER_SYMBOLS = {list: ("[", "]"), tuple: ("(", ")"), dict: ("{", "}")}
 SYMBOL_TO_FMT = {"[": "l", "(": "t", "{": "d"}
 
@@ -32,47 +35,47 @@ class TypecastException(Exception):
 
 
 def _write_fmt(data: Any, top: bool = True):
-    fmt = ""
-    encoded_data = b""
-    container_len = 0
+    data_type = type(data)
 
-    if isinstance(data, (list, tuple, dict)):  # Container, recurse through all items
-        inner_fmt = ""
-        open_punc, close_punc = CONTAINER_SYMBOLS[type(data)]
+    if data_type in CONTAINER_SYMBOLS:  # Container, recurse through all items
+        container_len = 0
+        inner_fmts = []
+        encoded_items = []
 
-        data_to_encode = [data]  # Kind of a cool hack for the nested loop
-        if isinstance(data, dict):
-            data_to_encode = data.items()
+        data_to_encode = data
+        if data_type is dict:
+            data_to_encode = [item_part for item in data.items() for item_part in item]
 
-        for item in data_to_encode:
-            for item_part in item:
-                # Recursion to get item info
-                inner_item_fmt, encoded_item, item_container_len = _write_fmt(item_part, top=False)
-                if item_container_len == 0:  # Primitive
-                    item_container_len = int(inner_item_fmt[:-1])
+        for item_part in data_to_encode:
+            # Recursion to get item info
+            inner_item_fmt, encoded_item, item_container_len = _write_fmt(item_part, top=False)
+            if item_container_len == 0:  # Primitive
+                item_container_len = len(encoded_item)
 
-                container_len += item_container_len
-                inner_fmt += inner_item_fmt
-                encoded_data += encoded_item
+            container_len += item_container_len
+            inner_fmts.append(inner_item_fmt)
+            encoded_items.append(encoded_item)
 
+        # Joined once, instead of copying everything encoded so far for every item
+        inner_fmt = "".join(inner_fmts)
         if top:  # Include beginning fmt to tell what type the result should be
-            fmt += CONTAINER_TO_FMT.get(type(data), "") + inner_fmt
+            fmt = CONTAINER_TO_FMT[data_type] + inner_fmt
         else:  # Container: add container len with symbols surrounding the inner fmt
-            fmt += f"{container_len}{open_punc}{inner_fmt}{close_punc}"
-    else:  # Primitive
-        try:
-            encode_func = TYPE_TO_ENCODE_FUNC[type(data)]
-        except KeyError:
-            raise TypecastException(
-                f'Failed to find default encoding function for "{data}" of type "{type(data)}". If you want to send this, convert it manually to and from bytes.'
-            ) from None
+            open_punc, close_punc = CONTAINER_SYMBOLS[data_type]
+            fmt = f"{container_len}{open_punc}{inner_fmt}{close_punc}"
 
-        fmt_letter = TYPE_TO_FMT[type(data)]
-        encoded_data = encode_func(data)
+        return fmt, b"".join(encoded_items), container_len
 
-        fmt += f"{len(encoded_data)}{fmt_letter}"
+    # Primitive
+    try:
+        fmt_letter, encode_func = TYPE_TO_FMT_AND_ENCODE_FUNC[data_type]
+    except KeyError:
+        raise TypecastException(
+            f'Failed to find default encoding function for "{data}" of type "{type(data)}". If you want to send this, convert it manually to and from bytes.'
+        ) from None
 
-    return fmt, encoded_data, container_len
+    encoded_data = encode_func(data)
+    return f"{len(encoded_data)}{fmt_letter}", encoded_data, 0
 
 
 def write_fmt(data: Any) -> tuple[str, bytes]:  # hide top param and container len
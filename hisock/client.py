@@ -14,12 +14,12 @@ Copyright SSS_Says_Snek, 2021-present
 from __future__ import annotations  # Remove when 3.10 is used by majority
 
 import errno  # Handle fatal errors with the server
-import json  # Handle sending dictionaries
 import socket
 import sys  # Utilize stderr
 import threading  # Threaded client and decorators
 import traceback  # Error handling
 from ipaddress import IPv4Address  # Comparisons
+from itertools import islice  # Slicing the cache
 from time import time  # Unix timestamp support
 from typing import Callable, Union  # Type hints
 
@@ -28,15 +28,17 @@ try:
     from ._shared import _HiSockBase
     from .utils import (ClientException, ClientInfo, ClientNotFound,
                         MessageCacheMember, Sendable, ServerException,
-                        ServerNotRunning, _recv_exactly, _removeprefix,
-                        iptup_to_str, make_header, validate_ipv4)
+                        ServerNotRunning, _json_dumps, _json_loads,
+                        _recv_exactly, _removeprefix, _send_parts,
+                        iptup_to_str, validate_ipv4)
 except ImportError:
     import _typecast
     from _shared import _HiSockBase
     from utils import (ClientException, ClientInfo, ClientNotFound,
                        MessageCacheMember, Sendable, ServerException,
-                       ServerNotRunning, _recv_exactly, _removeprefix,
-                       iptup_to_str, make_header, validate_ipv4)
+                       ServerNotRunning, _json_dumps, _json_loads,
+                       _recv_exactly, _removeprefix, _send_parts,
+                       iptup_to_str, validate_ipv4)
 
 
 # ░█████╗░░█████╗░██╗░░░██╗████████╗██╗░█████╗░███╗░░██╗██╗
@@ -81,6 +83,11 @@ class HiSockClient(_HiSockBase):
         -1 or below for no message cache, 0 for an unlimited cache size,
         and any other number for the cache size.
     :type cache_size: int, optional
+    :param tcp_nodelay: A bool indicating whether Nagle's algorithm should be disabled on
+        the connection to the server. HiSock sends many small messages, which Nagle's
+        algorithm would otherwise hold back for up to tens of milliseconds.
+        Default is True.
+    :type tcp_nodelay: bool, optional
 
     :ivar tuple addr: A two-element tuple containing the IP address and the
         port number of the server.
@@ -102,6 +109,7 @@ class HiSockClient(_HiSockBase):
         group: Union[str, None] = None,
         header_len: int = 16,
         cache_size: int = -1,
+        tcp_nodelay: bool = True,
     ):
         super().__init__(addr=addr, header_len=header_len, cache_size=cache_size)
 
@@ -118,6 +126,8 @@ class HiSockClient(_HiSockBase):
         except ConnectionRefusedError:
             raise ServerNotRunning("Server is not running! Aborting...") from None
         self.sock.setblocking(True)
+        if tcp_nodelay:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         # Stores the names of the reserved functions and information about them
         self._reserved_funcs = {"client_connect": 1, "client_disconnect": 1, "force_disconnect": 0, "*": 2}
@@ -205,7 +215,7 @@ class HiSockClient(_HiSockBase):
             raise ClientException(f"Client is already connected! (connected {time() - self.connect_time} seconds ago)")
 
         hello_dict = {"name": self.name, "group": self.group}
-        self._send_raw(f"$CLTHELLO${json.dumps(hello_dict)}".encode())
+        self._send_raw(b"$CLTHELLO$" + _json_dumps(hello_dict))
 
         self.connected = True
         self.connect_time = time()
@@ -277,9 +287,15 @@ class HiSockClient(_HiSockBase):
         """
 
         if idx is None:
-            return self.cache
+            return list(self.cache)
+        if isinstance(idx, int):
+            # Deques index directly, no need to copy the cache
+            return self.cache[idx]
 
-        return self.cache[idx]
+        start, stop, step = idx.indices(len(self.cache))
+        if step > 0:
+            return list(islice(self.cache, start, stop, step))
+        return list(self.cache)[idx]
 
     def get_client(self, client: Union[tuple[str, int], str]) -> ClientInfo:
         """
@@ -296,15 +312,14 @@ class HiSockClient(_HiSockBase):
         :raises ServerException: If another error occurred.
         """
 
-        try:
-            validate_ipv4(iptup_to_str(client))
-        except ValueError as e:
-            # Names are allowed, too.
-            if not isinstance(client, str):
-                raise e
+        # Names are sent as-is, only IP+port tuples need validating
+        if not isinstance(client, str):
+            validate_ipv4(client)
+            client = iptup_to_str(client)
 
+        self._add_recv_listener("$GETCLT$")
         self._send_raw(f"$GETCLT${client}".encode())
-        response = self.recv()
+        response = _json_loads(self._wait_recv("$GETCLT$"))
 
         # Validate response
         if "traceback" in response:
@@ -347,7 +362,7 @@ class HiSockClient(_HiSockBase):
         :type content: Sendable, optional
         """
 
-        self.sock.sendall(self._prepare_send(command, content))
+        _send_parts(self.sock, self._prepare_send_parts(command, content))
 
     def _send_raw(self, content: bytes):
         """
@@ -359,8 +374,7 @@ class HiSockClient(_HiSockBase):
         :type content: bytes
         """
 
-        header = make_header(content, self.header_len)
-        self.sock.sendall(header + content)
+        _send_parts(self.sock, (self._header_format(len(content)).encode(), content))
 
     # Changers
 
@@ -458,7 +472,7 @@ class HiSockClient(_HiSockBase):
                 if "client_connect" not in self.funcs:
                     return
 
-                client_info = ClientInfo.from_dict(json.loads(_removeprefix(data, b"$CLTCONN$")))
+                client_info = ClientInfo.from_dict(_json_loads(_removeprefix(data, b"$CLTCONN$")))
                 self._call_function_reserved("client_connect", client_info)
                 return
 
@@ -467,7 +481,7 @@ class HiSockClient(_HiSockBase):
                 if "client_disconnect" not in self.funcs:
                     return
 
-                client_info = ClientInfo.from_dict(json.loads(_removeprefix(data, b"$CLTDISCONN$")))
+                client_info = ClientInfo.from_dict(_json_loads(_removeprefix(data, b"$CLTDISCONN$")))
                 self._call_function_reserved("client_disconnect", client_info)
                 return
 
@@ -493,28 +507,28 @@ class HiSockClient(_HiSockBase):
 
             # Call functions that are listening for this command from the `on`
             # decorator
-            for matching_command, func in self.funcs.items():
-                if command != matching_command:
-                    continue
-
+            func = self.funcs.get(command)
+            if func is not None:
                 has_listener = True
 
                 # Call function with dynamic args
                 arguments = ()
                 if func["num_args"] == 1:
                     arguments = (typecasted_content,)
-                self._call_function(matching_command, *arguments)
-                break
+                self._call_handler(func, arguments, {})
             else:
                 has_listener = self._handle_recv_commands(command, unfmt_content)
 
             # No listener found
-            if not has_listener and "*" in self.funcs:
-                # No recv and no catchall. A command and some data.
-                self._call_wildcard_function(client_info=None, command=command, content=typecasted_content)
+            if not has_listener:
+                wildcard_func = self.funcs.get("*")
+                if wildcard_func is not None:
+                    # No recv and no catchall. A command and some data.
+                    self._call_handler(wildcard_func, (command, typecasted_content), {})
 
             # Caching
-            self._cache(has_listener, command, content, data, content_header)
+            if self.cache_size >= 0:
+                self._cache(has_listener, command, content, data, content_header)
 
         except IOError as e:
             # Normal, means message has ended
@@ -568,13 +582,17 @@ class HiSockClient(_HiSockBase):
         :type error_handler: Callable, optional
         """
 
+        # Checked once, not after every message
+        if not callable(callback):
+            callback = None
+
         try:
             while not self.closed:
                 self._update()
-                if isinstance(callback, Callable):
+                if callback is not None:
                     callback()
         except Exception as e:
-            if isinstance(error_handler, Callable):
+            if callable(error_handler):
                 error_handler(e)
             else:
                 raise e
@@ -612,12 +630,15 @@ class ThreadedHiSockClient(HiSockClient):
     def _start(self, callback: Callable = None, error_handler: Callable = None):
         """Start the main loop for the threaded client."""
 
+        if not callable(callback):
+            callback = None
+
         def updated_callback():
             if self._stop_event.is_set() and not self.closed:
                 self.close()
 
             # Original callback
-            if isinstance(callback, Callable):
+            if callback is not None:
                 callback()
 
         super().start(callback=updated_callback, error_handler=error_handler)
@@ -12,11 +12,16 @@ Copyright SSS_Says_Snek 2021-present
 # Imports
 from __future__ import annotations  # Remove when 3.10 is used by majority
 
-import json  # Handle sending dictionaries
-import select  # Handle multiple clients at once
+import json  # Invalid client hellos
+import logging  # Debug output
+import selectors  # Handle multiple clients at once
 import socket
 import threading  # Threaded server and decorators
+import warnings  # Ambiguous client names
+from dataclasses import replace  # Changing client names and groups
+from functools import lru_cache, total_ordering  # Comparisons
 from ipaddress import IPv4Address  # Comparisons
+from operator import attrgetter  # Getting a field of every client
 from typing import Callable, Iterable, Optional, Union  # Type hints
 
 try:
@@ -24,15 +29,18 @@ try:
     from ._shared import _HiSockBase
     from .utils import (ClientException, ClientInfo, ClientNotFound,
                         GroupNotFound, Sendable, ServerException,
-                        _removeprefix, ipstr_to_tup, make_header,
+                        _json_dumps, _json_loads, _removeprefix,
+                        _send_parts, ipstr_to_tup, make_header,
                         receive_message, validate_ipv4)
 except ImportError:
     import _typecast
     from _shared import _HiSockBase
     from utils import (ClientException, ClientInfo, ClientNotFound,
-                       GroupNotFound, Sendable, ServerException, _removeprefix,
-                       ipstr_to_tup, make_header, receive_message,
-                       validate_ipv4)
+                       GroupNotFound, Sendable, ServerException, _json_dumps,
+                       _json_loads, _removeprefix, _send_parts, ipstr_to_tup,
+                       make_header, receive_message, validate_ipv4)
+
+_logger = logging.getLogger(__name__)
 
 
 # ░█████╗░░█████╗░██╗░░░██╗████████╗██╗░█████╗░███╗░░██╗██╗
@@ -45,6 +53,23 @@ except ImportError:
 # If this code is changed, the server may not work properly
 
 
+@lru_cache(maxsize=256)
+def _parse_addr_ip(addr: str) -> IPv4Address:
+    """
+    Parses the IP address of an "ip:port" string for comparisons. Cached, as the
+    same strings tend to be compared against over and over (when sorting, for example).
+
+    :param addr: The address, in the format "ip:port".
+    :type addr: str
+
+    :return: The IP address.
+    :rtype: IPv4Address
+    """
+
+    return IPv4Address(addr.split(":", 1)[0])
+
+
+@total_ordering
 class HiSockServer(_HiSockBase):
     """
     The server class for :mod:`HiSock`.
@@ -78,20 +103,44 @@ class HiSockServer(_HiSockBase):
         acknowledge signal to show that they are still alive.
         Default is False FOR NOW. Investigating further.
     :type keepalive: bool, optional
+    :param tcp_nodelay: A bool indicating whether Nagle's algorithm should be disabled on
+        client connections. HiSock sends many small messages, which Nagle's algorithm would
+        otherwise hold back for up to tens of milliseconds.
+        Default is True.
+    :type tcp_nodelay: bool, optional
+    :param parallel_broadcasts: A bool indicating whether messages sent to several clients
+        should be sent from several threads (up to ``BROADCAST_THREADS``). A client that
+        isn't reading fast enough then only holds up the clients sharing its thread, instead
+        of every client after it.
+        Default is False.
+    :type parallel_broadcasts: bool, optional
+    :param reuse_port: A bool indicating whether ``SO_REUSEPORT`` should be set on the server
+        socket, so that several servers (usually one per process) can listen on the same
+        address and have the OS share the incoming connections between them. Clients
+        connected to different servers can't see each other.
+        Default is False.
+    :type reuse_port: bool, optional
 
     :ivar tuple addr: A two-element tuple containing the IP address and the port.
     :ivar int header_len: An integer storing the header length of each "message".
     :ivar dict clients: A dictionary with the socket as its key and the
         client info as its value.
     :ivar dict clients_rev: A dictionary with the client info as its key
-        and the socket as its value (for reverse lookup, up-to-date with
-        :attr:`clients`).
+        and the socket as its value (for reverse lookup, built from
+        :attr:`clients` on each access).
     :ivar dict funcs: A list of functions registered with decorator :meth:`on`.
         **This is mainly used for under-the-hood-code.**
 
     :raises TypeError: If the address is not a tuple.
+    :raises ServerException: If ``reuse_port`` is True, but ``SO_REUSEPORT`` isn't
+        supported on this platform.
     """
 
+    SO_SNDBUF_SIZE = 262144
+    SO_RCVBUF_SIZE = 262144
+    KEEPALIVE_INTERVAL = 30  # Seconds between keepalives, and to answer one
+    BROADCAST_THREADS = 16  # With `parallel_broadcasts`
+
     def __init__(
         self,
         addr: tuple[str, int],
@@ -99,29 +148,68 @@ class HiSockServer(_HiSockBase):
         header_len: int = 16,
         cache_size: int = -1,
         keepalive: bool = False,  # DISABLE KEEPALIVE FOR NOW
+        tcp_nodelay: bool = True,
+        parallel_broadcasts: bool = False,
+        reuse_port: bool = False,
     ):
         super().__init__(addr=addr, header_len=header_len, cache_size=cache_size)
 
         # Socket initialization
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setblocking(True)
+        if reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                self.socket.close()
+                raise ServerException("SO_REUSEPORT isn't supported on this platform.")
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         try:
             self.socket.bind(addr)
         except socket.gaierror as e:  # getaddrinfo error
             raise TypeError("The IP address and/or port are invalid.") from e
         self.socket.listen(max_connections)
-
-        # Dictionaries and lists for client lookup
-        self._sockets_list = [self.socket]  # Our socket will always be the first
+        # The bound address is always numeric, even if `addr` used a hostname
+        self._ip = IPv4Address(self.socket.getsockname()[0])
+        self._tcp_nodelay = tcp_nodelay
+        self._parallel_broadcasts = parallel_broadcasts
+
+        # Dictionaries for client lookup
+        # epoll/kqueue where available, so waking up only costs O(ready sockets)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        # Closing the server socket doesn't wake up the selector, so `close` writes to this
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._running = False
         self.clients: dict[socket.socket, ClientInfo] = {}
-        self.clients_rev: dict[ClientInfo, socket.socket] = {}
-        
+        # Rebuilt whenever a client joins or leaves, so that broadcasts (which can come from
+        # any thread) don't copy `clients` every time
+        self._client_sockets: tuple[socket.socket, ...] = ()
+        # Secondary indexes (kept up-to-date with `clients`)
+        # Dicts with None values are used as ordered sets: O(1) removal, and lookups
+        # still go by connection order like the old linear scan did
+        self._sockets_by_ip: dict[tuple[str, int], socket.socket] = {}
+        self._sockets_by_name: dict[str, dict[socket.socket, None]] = {}
+        self._sockets_by_group: dict[str, dict[socket.socket, None]] = {}
+
+        # Reserved commands sent by clients, by the `$TOKEN$` their data starts with
+        self._reserved_commands: dict[bytes, Callable[[socket.socket, ClientInfo, bytes], None]] = {
+            b"$USRCLOSE$": self._handle_user_close,
+            b"$CHNAME$": self._handle_change_name,
+            b"$CHGROUP$": self._handle_change_group,
+            b"$KEEPACK$": self._handle_keepalive,
+            b"$GETCLT$": self._handle_get_client,
+        }
+
+        # Prebuilt messages
+        self._disconn_message = make_header(b"$DISCONN$", self.header_len) + b"$DISCONN$"
+        self._keepalive_message = make_header(b"$KEEPALIVE$", self.header_len) + b"$KEEPALIVE$"
+
         self._reserved_funcs = {"join": 1, "leave": 1, "message": 3, "name_change": 3, "group_change": 3, "*": 3}
         self._unreserved_func_arguments = ("client", "message")
 
         # Keepalive
         self._keepalive_event = threading.Event()
-        self._unresponsive_clients = []
+        self._unresponsive_clients: set[socket.socket] = set()
         self._keepalive = keepalive
 
         if self._keepalive:
@@ -136,61 +224,53 @@ class HiSockServer(_HiSockBase):
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def clients_rev(self) -> dict[ClientInfo, socket.socket]:
+        """
+        A dictionary with the client info as its key and the socket as its value.
+        Built on each access; lookups by name, IP or group go through indexes instead.
+
+        :return: The client sockets by client info.
+        :rtype: dict[ClientInfo, socket.socket]
+        """
+
+        return {client_info: client_socket for client_socket, client_info in tuple(self.clients.items())}
+
     def __len__(self):
         """Returns how many clients are connected"""
 
         return len(self.clients)
 
     # Comparisons
-    def __gt__(self, other: Union[HiSockServer, str]):
-        """Example: HiSockServer(...) > "192.168.1.133:5000" """
 
-        if type(other) not in (self.__class__, str):
-            raise TypeError("Type not supported for > comparison.")
-        if isinstance(other, HiSockServer):
-            return IPv4Address(self.addr[0]) > IPv4Address(other.addr[0])
-        ip = other.split(":")
-        return IPv4Address(self.addr[0]) > IPv4Address(ip[0])
+    def _other_ip(self, other: Union[HiSockServer, str]) -> IPv4Address:
+        """
+        Gets the IP address to compare against.
 
-    def __ge__(self, other: Union[HiSockServer, str]):
-        """Example: HiSockServer(...) >= "192.168.1.133:5000" """
+        :param other: Another server, or a string in the format "ip:port".
+        :type other: Union[HiSockServer, str]
 
-        if type(other) not in (self.__class__, str):
-            raise TypeError("Type not supported for >= comparison.")
-        if isinstance(other, HiSockServer):
-            return IPv4Address(self.addr[0]) >= IPv4Address(other.addr[0])
-        ip = other.split(":")
-        return IPv4Address(self.addr[0]) >= IPv4Address(ip[0])
+        :return: The IP address of ``other``.
+        :rtype: IPv4Address
 
-    def __lt__(self, other: Union[HiSockServer, str]):
-        """Example: HiSockServer(...) < "192.168.1.133:5000" """
+        :raises TypeError: If the type isn't supported for comparisons.
+        """
 
-        if type(other) not in (self.__class__, str):
-            raise TypeError("Type not supported for < comparison.")
         if isinstance(other, HiSockServer):
-            return IPv4Address(self.addr[0]) < IPv4Address(other.addr[0])
-        ip = other.split(":")
-        return IPv4Address(self.addr[0]) < IPv4Address(ip[0])
+            return other._ip
+        if isinstance(other, str):
+            return _parse_addr_ip(other)
+        raise TypeError("Type not supported for comparison.")
 
-    def __le__(self, other: Union[HiSockServer, str]):
-        """Example: HiSockServer(...) <= "192.168.1.133:5000" """
+    def __lt__(self, other: Union[HiSockServer, str]):
+        """Example: HiSockServer(...) < "192.168.1.133:5000" """
 
-        if type(other) not in (self.__class__, str):
-            raise TypeError("Type not supported for <= comparison.")
-        if isinstance(other, HiSockServer):
-            return IPv4Address(self.addr[0]) <= IPv4Address(other.addr[0])
-        ip = other.split(":")
-        return IPv4Address(self.addr[0]) <= IPv4Address(ip[0])
+        return self._ip < self._other_ip(other)
 
     def __eq__(self, other: Union[HiSockServer, str]):
         """Example: HiSockServer(...) == "192.168.1.133:5000" """
 
-        if type(other) not in (self.__class__, str):
-            raise TypeError("Type not supported for == comparison.")
-        if isinstance(other, HiSockServer):
-            return IPv4Address(self.addr[0]) == IPv4Address(other.addr[0])
-        ip = other.split(":")
-        return IPv4Address(self.addr[0]) > IPv4Address(ip[0])
+        return self._ip == self._other_ip(other)
 
     # Internal methods
 
@@ -207,27 +287,36 @@ class HiSockServer(_HiSockBase):
         :raises ClientException: If the client disconnected or had an error.
         """
 
-        if connection in self._sockets_list:
+        if connection in self.clients:
             raise ServerException("Client already connected.")
 
-        self._sockets_list.append(connection)
+        # Tune the socket for lots of small messages
+        if self._tcp_nodelay:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SO_SNDBUF_SIZE)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SO_RCVBUF_SIZE)
 
         # Receive the client hello
         client_hello = receive_message(connection, self.header_len, self.RECV_BUFFERSIZE)
         if not client_hello:
+            connection.close()
             raise ClientException("Client disconnected or had an error.")
         client_hello = _removeprefix(client_hello["data"], b"$CLTHELLO$")
         try:
-            client_hello = json.loads(client_hello)
+            client_hello = _json_loads(client_hello)
         except json.JSONDecodeError:
+            connection.close()
             raise ClientException("Client sent an invalid hello.") from None
 
+        # Only sockets of clients that said hello are watched, along with the server socket
+        self._selector.register(connection, selectors.EVENT_READ)
         client_info = ClientInfo(address, client_hello["name"], client_hello["group"])
         self.clients[connection] = client_info
-        self.clients_rev[client_info] = connection
+        self._client_sockets = tuple(self.clients)
+        self._index_client(connection, client_info)
 
         # Send reserved command to existing clients
-        self._send_all_clients_raw(f"$CLTCONN${json.dumps(client_info.as_dict())}".encode())
+        self._send_all_clients_raw(b"$CLTCONN$" + client_info._json())
 
         self._call_function_reserved("join", client_info)
 
@@ -238,65 +327,210 @@ class HiSockServer(_HiSockBase):
         :raises ClientNotFound: The client wasn't connected to the server.
         """
 
-        client_info = self.clients[client_socket]
-
-        if client_socket not in self._sockets_list:
+        client_info = self.clients.get(client_socket)
+        if client_info is None:
             raise ClientNotFound(f'Client "{client_socket}" is not connected.')
 
+        self._selector.unregister(client_socket)
         try:
             client_socket.close()
         except OSError:
             # Already closed
             pass
-        self._sockets_list.remove(client_socket)
         del self.clients[client_socket]
-        del self.clients_rev[client_info]
+        self._client_sockets = tuple(self.clients)
+        self._unindex_client(client_socket, client_info)
         # Note: ``self._unresponsive_clients`` should be handled by the keepalive
 
         # Send the client disconnection event to the clients
-        self._send_all_clients_raw(f"$CLTDISCONN${json.dumps(client_info.as_dict())}".encode())
+        self._send_all_clients_raw(b"$CLTDISCONN$" + client_info._json())
+
+    def _index_client(self, client_socket: socket.socket, client_info: ClientInfo):
+        """
+        Adds a client to the secondary lookup indexes.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        """
+
+        self._sockets_by_ip[client_info.ip] = client_socket
+        self._sockets_by_name.setdefault(client_info.name, {})[client_socket] = None
+        self._sockets_by_group.setdefault(client_info.group, {})[client_socket] = None
+
+    def _unindex_client(self, client_socket: socket.socket, client_info: ClientInfo):
+        """
+        Removes a client from the secondary lookup indexes.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info the client was indexed with.
+        :type client_info: ClientInfo
+        """
+
+        del self._sockets_by_ip[client_info.ip]
+        for index, key in ((self._sockets_by_name, client_info.name), (self._sockets_by_group, client_info.group)):
+            index_sockets = index[key]
+            del index_sockets[client_socket]
+            if not index_sockets:
+                del index[key]
+
+    # Reserved commands
+    # All of them take the client socket, its client info, and the data after the command
+
+    def _handle_user_close(self, client_socket: socket.socket, client_info: ClientInfo, content: bytes):
+        """
+        Handles a client leaving, or its connection ending.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        :param content: Unused.
+        :type content: bytes
+        """
+
+        try:
+            self.disconnect_client(client_info, force=False, call_func=True)
+        except BrokenPipeError:  # UNIX
+            # Client is already gone
+            pass
+        except ConnectionResetError:
+            self.disconnect_client(client_info, force=True, call_func=True)
+
+    def _handle_change_name(self, client_socket: socket.socket, client_info: ClientInfo, content: bytes):
+        """
+        Handles a client changing its name.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        :param content: The new name, or nothing to reset it.
+        :type content: bytes
+        """
+
+        self._change_client_info(client_socket, client_info, "name", content.decode())
+
+    def _handle_change_group(self, client_socket: socket.socket, client_info: ClientInfo, content: bytes):
+        """
+        Handles a client changing its group.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        :param content: The new group, or nothing to reset it.
+        :type content: bytes
+        """
+
+        self._change_client_info(client_socket, client_info, "group", content.decode())
+
+    def _change_client_info(self, client_socket: socket.socket, client_info: ClientInfo, key: str, change_to: str):
+        """
+        Changes the name or group of a client, and calls ``name_change`` or ``group_change``.
+
+        :param client_socket: The client socket.
+        :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        :param key: Either "name" or "group".
+        :type key: str
+        :param change_to: The new value, or an empty string to reset it.
+        :type change_to: str
+        """
+
+        old_value = getattr(client_info, key)
+
+        # Resetting
+        if change_to == "":
+            change_to = old_value
+
+        # Change it
+        new_client_info = replace(client_info, **{key: change_to})
+        self.clients[client_socket] = new_client_info
+        self._unindex_client(client_socket, client_info)
+        self._index_client(client_socket, new_client_info)
+
+        # Reserved, so nothing happens if there's no handler for it
+        self._call_function_reserved(f"{key}_change", new_client_info, old_value, change_to)
+
+    def _handle_get_client(self, client_socket: socket.socket, client_info: ClientInfo, content: bytes):
+        """
+        Sends the client info of the client asked for by :meth:`HiSockClient.get_client`.
+
+        :param client_socket: The client socket asking.
+        :type client_socket: socket.socket
+        :param client_info: The client info of the client asking.
+        :type client_info: ClientInfo
+        :param content: The name or IP+port ("ip:port") of the client to get.
+        :type content: bytes
+        """
+
+        try:
+            client_identifier = content.decode()
+
+            # Determine if the client identifier is a name or an IP+port
+            try:
+                ip_tuple = ipstr_to_tup(client_identifier)
+                validate_ipv4(ip_tuple)
+                client_identifier = ip_tuple
+            except ValueError:
+                pass
+
+            response = self.get_client(client_identifier)._json()
+        except ValueError as e:
+            response = _json_dumps({"traceback": str(e)})
+        except ClientNotFound:
+            response = _json_dumps({"traceback": "$NOEXIST$"})
+
+        # Framed like any other message, the client's `recv` is waiting for it
+        client_socket.sendall(self._prepare_send("$GETCLT$", response))
 
     # Keepalive
 
-    def _handle_keepalive(self, client_socket: socket.socket):
+    def _handle_keepalive(self, client_socket: socket.socket, client_info: ClientInfo, content: bytes):
         """
         Handles a keepalive acknowledgment sent by a client.
 
         :param client_socket: The client socket that sent the acknowledgment.
         :type client_socket: socket.socket
+        :param client_info: The client info.
+        :type client_info: ClientInfo
+        :param content: Unused.
+        :type content: bytes
         """
 
-        if client_socket in self._unresponsive_clients:
-            self._unresponsive_clients.remove(client_socket)
+        self._unresponsive_clients.discard(client_socket)
 
     def _keepalive_thread(self):
-        while not self._keepalive_event.is_set():
-            self._keepalive_event.wait(30)
-
+        # `wait` returns True once the server is closing
+        while not self._keepalive_event.wait(self.KEEPALIVE_INTERVAL):
             # Send keepalive to all clients
-            if not self._keepalive_event.is_set():
-                for client_socket in self.clients:
-                    if client_socket not in self.clients:
-                        continue
-
-                    self._unresponsive_clients.append(client_socket)
-                    client_socket.sendall(b"$KEEPALIVE$")
+            # The run loop adds and removes clients meanwhile, so use the snapshot
+            client_sockets = self._client_sockets
+            self._unresponsive_clients.update(client_sockets)
+            self._broadcast(client_sockets, self._keepalive_message)
 
             # Keepalive acknowledgments will be handled in `_handle_keepalive`
-            self._keepalive_event.wait(30)
+            if self._keepalive_event.wait(self.KEEPALIVE_INTERVAL):
+                return
 
             # Keepalive response wait is over, remove the unresponsive clients
-            if not self._keepalive_event.is_set():
-                for client_socket in self._unresponsive_clients:
-                    try:
-                        self.disconnect_client(
-                            self.clients[client_socket],
-                            force=True,
-                            call_func=True,
-                        )
-                    except KeyError:  # Client already left
-                        pass
-                self._unresponsive_clients.clear()
+            # (`_handle_keepalive` discards from the set meanwhile)
+            unresponsive_clients = tuple(self._unresponsive_clients)
+            self._unresponsive_clients.clear()
+            for client_socket in unresponsive_clients:
+                client_info = self.clients.get(client_socket)
+                if client_info is None:  # Client already left
+                    continue
+
+                try:
+                    self.disconnect_client(client_info, force=True, call_func=True)
+                except (KeyError, ClientNotFound):
+                    # Client left while being disconnected
+                    pass
 
     # On decorator
 
@@ -354,13 +588,10 @@ class HiSockServer(_HiSockBase):
         if isinstance(client, ClientInfo):
             return client
 
-        for client_info in self.clients_rev:
-            if isinstance(client, tuple) and client_info.ip == client:
-                return client_info
-            elif isinstance(client, str) and client_info.name == client:
-                return client_info
-
-        return None
+        client_socket = self._get_client_socket(client)
+        if client_socket is None:
+            return None
+        return self.clients[client_socket]
 
     def _get_client_socket(self, client: Union[tuple[str, int], str, ClientInfo]) -> Optional[socket.socket]:
         """
@@ -376,9 +607,22 @@ class HiSockServer(_HiSockBase):
             the same name is detected.
         """
 
-        client = self._get_clientinfo(client)
-        if client is not None:
-            return self.clients_rev[client]
+        if isinstance(client, ClientInfo):
+            # The IP+port is unique, and stays the same when a client changes its name
+            client = client.ip
+
+        if isinstance(client, tuple):
+            return self._sockets_by_ip.get(client)
+        if isinstance(client, str):
+            name_sockets = self._sockets_by_name.get(client)
+            if not name_sockets:
+                return None
+            if len(name_sockets) > 1:
+                warnings.warn(
+                    f'{len(name_sockets)} clients are named "{client}", using the first one to connect.',
+                    UserWarning,
+                )
+            return next(iter(name_sockets))
         return None
 
     def _get_group_sockets(self, group: str) -> Iterable[socket.socket]:
@@ -395,9 +639,7 @@ class HiSockServer(_HiSockBase):
            If the group does not exist, an empty iterable is returned.
         """
 
-        return map(
-            lambda client: self.clients_rev[client], filter(lambda client: client.group == group, self.clients_rev)
-        )
+        return iter(self._sockets_by_group.get(group, ()))
 
     def get_group(self, group: Union[ClientInfo, str]) -> list[ClientInfo]:
         """
@@ -440,11 +682,10 @@ class HiSockServer(_HiSockBase):
         if key is None:
             return clients
 
-        filter_clients = []
-        if key in ["ip", "name", "group"]:
-            for filter_client in clients:
-                filter_clients.append(filter_client.as_dict()[key])
-        return filter_clients
+        if key not in ("ip", "name", "group"):
+            return []
+        # Reads the field directly instead of building a dict per client
+        return list(map(attrgetter(key), clients))
 
     def get_client(self, client: Union[str, tuple[str, int]]) -> ClientInfo:
         """
@@ -476,6 +717,60 @@ class HiSockServer(_HiSockBase):
 
     # Transmit data
 
+    def _broadcast(self, client_sockets: Iterable[socket.socket], data: bytes):
+        """
+        Sends the same already-framed data to several clients.
+
+        :param client_sockets: The sockets of the clients to send the data to.
+        :type client_sockets: Iterable[socket.socket]
+        :param data: The data to send, including its header.
+        :type data: bytes
+        """
+
+        # Broadcasts can come from any thread while the run loop adds and removes
+        # clients, so iterate over a snapshot
+        client_sockets = tuple(client_sockets)
+        if not self._parallel_broadcasts or len(client_sockets) < 2:
+            self._send_each(client_sockets, data)
+            return
+
+        # Split the clients between the threads, and wait for all of them so that
+        # messages still arrive in the order they're sent
+        socket_shares = [
+            client_sockets[i :: self.BROADCAST_THREADS] for i in range(min(self.BROADCAST_THREADS, len(client_sockets)))
+        ]
+        shares_sent = threading.Semaphore(0)
+
+        def send_share(socket_share: tuple[socket.socket, ...]):
+            try:
+                self._send_each(socket_share, data)
+            finally:
+                shares_sent.release()
+
+        for socket_share in socket_shares[1:]:
+            self._handler_threads.submit(send_share, (socket_share,), {})
+        self._send_each(socket_shares[0], data)  # This thread takes a share too
+        for _ in socket_shares[1:]:
+            shares_sent.acquire()
+
+    @staticmethod
+    def _send_each(client_sockets: Iterable[socket.socket], data: bytes):
+        """
+        Sends data to clients one after another, skipping clients that left.
+
+        :param client_sockets: The sockets of the clients to send the data to.
+        :type client_sockets: Iterable[socket.socket]
+        :param data: The data to send, including its header.
+        :type data: bytes
+        """
+
+        for client_socket in client_sockets:
+            try:
+                client_socket.sendall(data)
+            except OSError:
+                # The client left mid-broadcast, the run loop handles its disconnection
+                continue
+
     def _send_all_clients_raw(self, content: bytes):
         """
         Sends the command and content to *ALL* clients connected *without a command*.
@@ -484,9 +779,8 @@ class HiSockServer(_HiSockBase):
         :type content: Sendable
         """
 
-        content_header = make_header(content, self.header_len)
-        for client in self.clients:
-            client.sendall(content_header + content)
+        # Build the frame once, not once per client
+        self._broadcast(self._client_sockets, self._header_format(len(content)).encode() + content)
 
     def send_all_clients(self, command: str, content: Optional[Sendable] = None):
         """
@@ -498,9 +792,19 @@ class HiSockServer(_HiSockBase):
         :type content: Sendable, optional
         """
 
-        data = self._prepare_send(command, content)
-        for client in self.clients:
-            client.sendall(data)
+        self._broadcast(self._client_sockets, self._prepare_send(command, content))
+
+    def send_all_clients_batch(self, messages: Iterable[tuple[str, Optional[Sendable]]]):
+        """
+        Sends several commands and their content to *ALL* clients connected, in order.
+        Every message is built once, and each client is sent all of them in one go, instead
+        of one small write per message per client.
+
+        :param messages: The messages to send, as ``(command, content)`` pairs.
+        :type messages: Iterable[tuple[str, Sendable]]
+        """
+
+        self._broadcast(self._client_sockets, self._prepare_send_batch(messages))
 
     def send_group(self, group: Union[ClientInfo, str], command: str, content: Optional[Sendable] = None):
         """
@@ -523,9 +827,41 @@ class HiSockServer(_HiSockBase):
         if isinstance(group, ClientInfo):
             group = group.group
 
-        data = self._prepare_send(command, content)
-        for client in self._get_group_sockets(group):
-            client.sendall(data)
+        self._broadcast(self._get_group_sockets(group), self._prepare_send(command, content))
+
+    def send_group_batch(self, group: Union[ClientInfo, str], messages: Iterable[tuple[str, Optional[Sendable]]]):
+        """
+        Sends several commands and their content to a specific group, in order.
+        See :meth:`send_all_clients_batch` and :meth:`send_group`.
+
+        :param group: Either a ClientInfo representing a client in a group, or a string representing the group to send data to.
+        :type group: str
+        :param messages: The messages to send, as ``(command, content)`` pairs.
+        :type messages: Iterable[tuple[str, Sendable]]
+
+        :raises TypeError: If the group does not exist, or the client
+            is not in a group (``ClientInfo``).
+        """
+
+        if isinstance(group, ClientInfo):
+            group = group.group
+
+        self._broadcast(self._get_group_sockets(group), self._prepare_send_batch(messages))
+
+    def _prepare_send_batch(self, messages: Iterable[tuple[str, Optional[Sendable]]]) -> bytes:
+        """
+        Builds several messages back to back, to be sent with one write per client.
+
+        :param messages: The messages to build, as ``(command, content)`` pairs.
+        :type messages: Iterable[tuple[str, Sendable]]
+
+        :return: The headers and data of every message.
+        :rtype: bytes
+        """
+
+        return b"".join(
+            part for command, content in messages for part in self._prepare_send_parts(command, content)
+        )
 
     def send_client(
         self, client: Union[str, tuple[str, int], ClientInfo], command: str, content: Optional[Sendable] = None
@@ -547,8 +883,11 @@ class HiSockServer(_HiSockBase):
             the same name is detected.
         """
 
-        data = self._prepare_send(command, content)
-        self._get_client_socket(client).sendall(data)
+        client_socket = self._get_client_socket(client)
+        if client_socket is None:
+            raise ClientNotFound(f"Client {client} does not exist.")
+
+        _send_parts(client_socket, self._prepare_send_parts(command, content))
 
     # Disconnect
 
@@ -581,7 +920,7 @@ class HiSockServer(_HiSockBase):
 
         if not force:
             try:
-                client_socket.sendall(b"$DISCONN$")
+                client_socket.sendall(self._disconn_message)
             except BrokenPipeError:
                 # Client is already gone
                 pass
@@ -594,16 +933,18 @@ class HiSockServer(_HiSockBase):
         """Disconnect all clients."""
 
         if not force:
-            self._send_all_clients_raw(b"$DISCONN$")
+            self._broadcast(self._client_sockets, self._disconn_message)
             return
 
-        for conn in self._sockets_list:
+        for conn in self._client_sockets:
+            self._selector.unregister(conn)
             conn.close()
 
-        self._sockets_list.clear()
-        self._sockets_list.append(self.socket)  # Server socket must be first
         self.clients.clear()
-        self.clients_rev.clear()
+        self._client_sockets = ()
+        self._sockets_by_ip.clear()
+        self._sockets_by_name.clear()
+        self._sockets_by_group.clear()
         self._unresponsive_clients.clear()  # BrokenPipeError with keepalive w/out clear
 
     # Run
@@ -621,10 +962,23 @@ class HiSockServer(_HiSockBase):
         if self.closed:
             return
 
-        read_socket, write_socket, exception_socket = select.select(self._sockets_list, [], self._sockets_list)
+        events = self._selector.select()
+
+        # Looked up once per wakeup instead of several times per message
+        clients = self.clients
+        funcs = self.funcs
+        reserved_commands = self._reserved_commands
+        header_len = self.header_len
+        buffer_size = self.RECV_BUFFERSIZE
+        cache_enabled = self.cache_size >= 0
 
         client_socket: socket.socket
-        for client_socket in read_socket:
+        for key, _ in events:
+            if self.closed:
+                # Woken up by `close`, the server socket can't accept anymore
+                return
+
+            client_socket = key.fileobj
             try:
                 ### Reserved commands ###
 
@@ -633,14 +987,14 @@ class HiSockServer(_HiSockBase):
                     # Client already disconnected
                     # This can happen in the case of a keepalive that wasn't responded to
                     # or the client already disconnected and it was already handled
-                    if client_socket not in self.clients:
+                    if client_socket not in clients:
                         continue
 
-                    self.disconnect_client(self.clients[client_socket], force=True, call_func=False)
+                    self.disconnect_client(clients[client_socket], force=True, call_func=False)
                     continue
 
                 # Handle new connection
-                # select.select() returns the server socket if a new connection is made
+                # The selector returns the server socket if a new connection is made
                 if client_socket == self.socket:
                     self._new_client_connection(*self.socket.accept())
                     continue
@@ -650,108 +1004,48 @@ class HiSockServer(_HiSockBase):
 
                 # {"header": bytes, "data": bytes} or False
                 self._receiving_data = True
-                raw_data = receive_message(client_socket, self.header_len, self.RECV_BUFFERSIZE)
+                raw_data = receive_message(client_socket, header_len, buffer_size)
                 self._receiving_data = False
 
                 if isinstance(raw_data, dict):
                     data = raw_data["data"]
 
                 try:
-                    client_info = self.clients[client_socket]
+                    client_info = clients[client_socket]
                 except KeyError:
                     raise ClientNotFound("Client data not found, but is not a new client.") from KeyError
 
                 ### Reserved commands ###
 
-                # Handle client disconnection
-                if not raw_data or data.startswith(  # Most likely client disconnect, could be client error
-                    b"$USRCLOSE$"
-                ):
-
-                    try:
-                        self.disconnect_client(client_info, force=False, call_func=True)
-                    except BrokenPipeError:  # UNIX
-                        # Client is already gone
-                        pass
-                    except ConnectionResetError:
-                        self.disconnect_client(client_info, force=True, call_func=True)
-
+                # Most likely client disconnect, could be client error
+                if not raw_data:
+                    self._handle_user_close(client_socket, client_info, b"")
                     continue
 
-                # Change name or group
-                for matching_reserve, key in zip((b"$CHNAME$", b"$CHGROUP$"), ("name", "group")):
-
-                    if not data.startswith(matching_reserve):
+                # One lookup of the leading `$TOKEN$`, instead of checking every prefix
+                if data[:1] == b"$":
+                    token_end = data.find(b"$", 1) + 1
+                    handler = reserved_commands.get(data[:token_end])
+                    if handler is not None:
+                        handler(client_socket, client_info, data[token_end:])
                         continue
 
-                    change_to = _removeprefix(data, matching_reserve).decode()
-                    client_info_dict = client_info.as_dict()
-
-                    # Resetting
-                    if change_to == "":
-                        change_to = client_info_dict[key]
-
-                    # Change it
-                    new_client_info_dict = client_info.as_dict()
-                    new_client_info_dict[key] = change_to
-
-                    new_client_info = ClientInfo.from_dict(new_client_info_dict)
-                    self.clients[client_socket] = new_client_info
-
-                    del self.clients_rev[client_info]
-                    self.clients_rev[new_client_info] = client_socket
-
-                    # Call reserved function
-                    reserved_func_name = f"{key}_change"
-                    old_value = client_info_dict[key]
-                    new_value = new_client_info_dict[key]
-
-                    self._call_function(
-                        reserved_func_name,
-                        new_client_info,
-                        old_value,
-                        new_value,
-                    )
-
-                    return
-
-                # Handle keepalive acknowledgement
-                if data.startswith(b"$KEEPACK$"):
-                    self._handle_keepalive(client_socket)
-                    continue
-
-                # Get client
-                elif data.startswith(b"$GETCLT$"):
-                    try:
-                        client_identifier = _removeprefix(data, b"$GETCLT$").decode()
-
-                        # Determine if the client identifier is a name or an IP+port
-                        try:
-                            validate_ipv4(client_identifier)
-                            client_identifier = ipstr_to_tup(client_identifier)
-                        except ValueError:
-                            pass
-
-                        client = self.get_client(client_identifier).as_dict()
-                    except ValueError as e:
-                        client = {"traceback": str(e)}
-                    except ClientNotFound:
-                        client = {"traceback": "$NOEXIST$"}
-
-                    self.clients_rev[client_info].sendall(json.dumps(client).encode())
-                    continue
-
                 ### Unreserved commands ###
                 has_listener = False  # For cache
 
-                # Get command and message
-                command = data.lstrip(b"$CMD$").split(b"$MSG$")[0].decode()
-                content = _removeprefix(data, f"$CMD${command}$MSG$".encode())
+                # Get command and message (`$CMD$<command>$MSG$<content>`), finding the
+                # separator once
+                msg_index = data.find(b"$MSG$", 5) if data.startswith(b"$CMD$") else -1
+                if msg_index == -1:
+                    # Not a command, there's nothing to call
+                    continue
+                command = data[5:msg_index].decode()
+                content = data[msg_index + 5 :]
                 unfmt_content = content
 
                 fmt = ""
-                # No content? (`_removeprefix` didn't do anything)
-                if not content or content == data:
+                # No content?
+                if not content:
                     content = None
                 else:
                     fmt_len = int(content[:8])
@@ -761,12 +1055,10 @@ class HiSockServer(_HiSockBase):
                 fmt_ast = _typecast.read_fmt(fmt)
                 typecasted_content = _typecast.typecast_data(fmt_ast, content)
 
-                # Call functions that are listening for this command from the `on`
+                # Call the function that is listening for this command from the `on`
                 # decorator
-                for matching_command, func in self.funcs.items():
-                    if command != matching_command:
-                        continue
-
+                func = funcs.get(command)
+                if func is not None:
                     has_listener = True
 
                     # Call function with dynamic args
@@ -777,28 +1069,32 @@ class HiSockServer(_HiSockBase):
                     # client_info, message
                     elif func["num_args"] >= 2:
                         arguments = (client_info, typecasted_content)
-                    self._call_function(matching_command, *arguments)
-                    break
+                    self._call_handler(func, arguments, {})
 
                 else:
                     has_listener = self._handle_recv_commands(command, unfmt_content)
 
                 # No listener found
-                if not has_listener and "*" in self.funcs:
-                    # No recv and no catchall. A command and some data.
-                    self._call_wildcard_function(client_info=client_info, command=command, content=typecasted_content)
+                if not has_listener:
+                    wildcard_func = funcs.get("*")
+                    if wildcard_func is not None:
+                        # No recv and no catchall. A command and some data.
+                        self._call_handler(wildcard_func, (client_info, command, typecasted_content), {})
 
                 # Caching
-                self._cache(has_listener, command, content, data, raw_data["header"])
+                if cache_enabled:
+                    self._cache(has_listener, command, content, data, raw_data["header"])
 
-                # Call `message` function
-                if "message" in self.funcs:
-                    self._call_function_reserved("message", client_info, command, typecasted_content)
+                # Call `message` function, unless it was overridden into a normal command
+                message_func = funcs.get("message")
+                if message_func is not None and not message_func["override"]:
+                    self._call_handler(message_func, (client_info, command, typecasted_content), {})
             except (BrokenPipeError, ConnectionResetError):
-                if client_socket in self.clients:
-                    # Does it need to be forced?? Investigate further
-                    self.disconnect_client(self.clients[client_socket]["ip"], force=True)
-                print("[DEBUG] 10054 exception, we're investigating")
+                # Forced, the connection is already broken. The socket is known, so
+                # there's no need to look it up again through `disconnect_client`
+                if client_socket in clients:
+                    self._client_disconnection(client_socket)
+                _logger.debug("Connection reset or broken pipe while handling a message")
 
     # Stop
 
@@ -812,6 +1108,11 @@ class HiSockServer(_HiSockBase):
 
         self.closed = True
         self._keepalive_event.set()
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            # Already closed
+            ...
         self.disconnect_all_clients()
         try:
             self.socket.shutdown(socket.SHUT_RDWR)
@@ -819,6 +1120,16 @@ class HiSockServer(_HiSockBase):
             # Bad file descriptor
             ...
         self.socket.close()
+        if not self._running:
+            # Otherwise, the main loop closes it once it's done with it
+            self._close_selector()
+
+    def _close_selector(self):
+        """Closes the selector and its wakeup sockets. Can be called more than once."""
+
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
 
     # Main loop
 
@@ -834,18 +1145,25 @@ class HiSockServer(_HiSockBase):
         :type error_handler: Callable, optional
         """
 
+        # Checked once, not after every message
+        if not callable(callback):
+            callback = None
+
+        self._running = True
         try:
             while not self.closed:
                 self._run()
-                if isinstance(callback, Callable):
+                if callback is not None:
                     callback()
         except Exception as e:
-            if isinstance(error_handler, Callable):
+            if callable(error_handler):
                 error_handler(e)
             else:
                 raise e
         finally:
             self.close()
+            self._running = False
+            self._close_selector()
 
 
 class ThreadedHiSockServer(HiSockServer):
@@ -889,12 +1207,15 @@ class ThreadedHiSockServer(HiSockServer):
     def _start(self, callback: Callable = None, error_handler: Callable = None):
         """Start the main loop for the threaded server."""
 
+        if not callable(callback):
+            callback = None
+
         def updated_callback():
             if self._stop_event.is_set() and not self.closed:
                 self.close()
 
             # Original callback
-            if isinstance(callback, Callable):
+            if callback is not None:
                 callback()
 
         super().start(callback=updated_callback, error_handler=error_handler)
@@ -13,11 +13,18 @@ Copyright SSS_Says_Snek, 2021-present
 
 from __future__ import annotations
 
+import json
+import re
 import socket
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
 from ipaddress import IPv4Address
-from re import search
-from typing import List, Dict, Optional, Type, Union  # Must use these for bare annots
+from typing import Any, List, Dict, Optional, Type, Union  # Must use these for bare annots
+
+try:
+    import orjson  # Optional, several times faster than json
+except ImportError:
+    orjson = None
 
 
 # Custom exceptions
@@ -91,7 +98,8 @@ class MessageCacheMember:
         return self.__str__()
 
 
-@dataclass(frozen=True)
+# No per-instance `__dict__` where dataclasses support it (Python 3.10+)
+@dataclass(frozen=True, **({"slots": True} if sys.version_info >= (3, 10) else {}))
 class ClientInfo:
     """
     The dataclass used to represent a client.
@@ -100,6 +108,9 @@ class ClientInfo:
     ip: Optional[tuple[str, int]]
     name: Optional[str] = None
     group: Optional[str] = None
+    # Serialized by `_json` on first use. Not copied by `dataclasses.replace`, so a
+    # renamed client gets serialized again
+    _json_cache: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
 
     @classmethod
     def from_dict(cls, dict_: dict) -> "ClientInfo":
@@ -114,7 +125,9 @@ class ClientInfo:
         :rtype: ClientInfo
         """
 
-        return cls(dict_["ip"], dict_["name"], dict_["group"])
+        ip = dict_["ip"]
+        # JSON turns the tuple into a list
+        return cls(tuple(ip) if ip is not None else None, dict_["name"], dict_["group"])
 
     @property
     def ipstr(self) -> str:
@@ -131,6 +144,20 @@ class ClientInfo:
         """
         return {"ip": self.ip, "name": self.name, "group": self.group, "ipstr": self.ipstr}
 
+    def _json(self) -> bytes:
+        """
+        Returns :meth:`as_dict` serialized to JSON. The result is cached, as the same
+        client is sent when it joins, when it leaves, and for every ``get_client``.
+
+        :return: The JSON, encoded in UTF-8.
+        :rtype: bytes
+        """
+
+        if self._json_cache is None:
+            # Frozen dataclass
+            object.__setattr__(self, "_json_cache", _json_dumps(self.as_dict()))
+        return self._json_cache
+
     def copy(self):
         """
         Returns a copy of the current ``ClientInfo``.
@@ -165,14 +192,14 @@ Sendable = Union[
 SendableTypes = Type[Sendable]
 
 
-def make_header(header_message: Union[str, bytes], header_len: int, encode=True) -> Union[str, bytes]:
+def make_header(header_message: Union[str, bytes, int], header_len: int, encode=True) -> Union[str, bytes]:
     """
     Makes a header of ``header_message``, with a maximum
     header length of ``header_len``
 
     :param header_message: A string OR bytes-like object, representing
-        the data to make a header from
-    :type header_message: Union[str, bytes]
+        the data to make a header from, or the length of that data
+    :type header_message: Union[str, bytes, int]
     :param header_len: An integer, specifying
         the actual header length (will be padded)
     :type header_len: int
@@ -182,28 +209,82 @@ def make_header(header_message: Union[str, bytes], header_len: int, encode=True)
     :rtype: Union[str, bytes]
     """
 
-    message_len = len(header_message)
+    message_len = header_message if isinstance(header_message, int) else len(header_message)
     constructed_header = f"{message_len}{' ' * (header_len - len(str(message_len)))}"
     if encode:
         return constructed_header.encode()
     return constructed_header
 
 
+def _send_parts(connection: socket.socket, parts: tuple[bytes, ...]):
+    """
+    Sends several buffers as one message. Where ``sendmsg`` exists, the buffers are
+    handed to the kernel in a single scatter-gather call without being joined first;
+    otherwise (Windows), they are joined and sent with ``sendall``.
+
+    :param connection: The socket to send the message through.
+    :type connection: socket.socket
+    :param parts: The buffers making up the message, in order.
+    :type parts: tuple[bytes, ...]
+    """
+
+    if not hasattr(connection, "sendmsg"):
+        connection.sendall(b"".join(parts))
+        return
+
+    bytes_sent = connection.sendmsg(parts)
+    if bytes_sent < sum(map(len, parts)):
+        # Partial write, send whatever is left over
+        connection.sendall(memoryview(b"".join(parts))[bytes_sent:])
+
+
+if orjson is not None:
+    _json_dumps = orjson.dumps
+    # Its JSONDecodeError subclasses json.JSONDecodeError
+    _json_loads = orjson.loads
+else:
+
+    def _json_dumps(obj: Any) -> bytes:
+        """
+        Serializes an object to JSON. Uses orjson if it's installed.
+
+        :param obj: The object to serialize.
+        :type obj: Any
+
+        :return: The JSON, encoded in UTF-8.
+        :rtype: bytes
+        """
+
+        return json.dumps(obj).encode()
+
+    _json_loads = json.loads
+
+
 def _recv_exactly(connection: socket.socket, length: int, buffer_size: int) -> Optional[bytes]:
-    data = b""
-    bytes_left = length
+    if length <= 0:
+        return b""
+
+    # Small messages almost always arrive in one piece, so skip the bookkeeping
+    data = connection.recv(min(length, buffer_size))
+    if not data:
+        return None
+    if len(data) == length:
+        return data
+
+    # Joined at the end, concatenating every part would copy the data received so far each time
+    data_parts = [data]
+    bytes_left = length - len(data)
 
     while bytes_left > 0:
         bytes_to_recv = min(bytes_left, buffer_size)
         data_part = connection.recv(bytes_to_recv)
         if not data_part:
-            data = None
-            break
+            return None
 
-        data += data_part
+        data_parts.append(data_part)
         bytes_left -= len(data_part)
 
-    return data
+    return b"".join(data_parts)
 
 
 def receive_message(connection: socket.socket, header_len: int, buffer_size: int) -> Union[dict[str, bytes], bool]:
@@ -247,6 +328,10 @@ def _removeprefix(
     return string[:]
 
 
+# Matches the "$command$" notation used for reserved commands
+_RESERVED_COMMAND_RE = re.compile(r"\$.+\$")
+
+
 def validate_command_not_reserved(command: str):
     """
     Checks for illegal $cmd$ notation (used for reserved functions).
@@ -257,7 +342,7 @@ def validate_command_not_reserved(command: str):
     :raises ValueError: If the command is reserved.
     """
 
-    if search(r"\$.+\$", command):
+    if _RESERVED_COMMAND_RE.search(command):
         raise ValueError(
             'The format "$command$" is used for reserved functions - ' "consider using a different format."
         )
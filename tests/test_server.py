@@ -0,0 +1,535 @@
+"""
+Tests HiSockServer, on its own and with clients connected to it
+"""
+
+from __future__ import annotations
+
+import socket
+import threading
+import time
+
+import pytest
+
+from hisock.client import ThreadedHiSockClient
+from hisock.server import HiSockServer, ThreadedHiSockServer
+from hisock.utils import (ClientNotFound, GroupNotFound, make_header,
+                          receive_message)
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def server():
+    server = HiSockServer(("127.0.0.1", 0))
+    yield server
+    server.socket.close()
+
+
+@pytest.fixture
+def running_server():
+    server = ThreadedHiSockServer(("127.0.0.1", 0))
+    server.start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def connect(running_server):
+    """Connects started clients to ``running_server``, and closes them afterwards"""
+
+    clients = []
+
+    def connect(name=None, group=None, handlers=None, **kwargs):
+        client = ThreadedHiSockClient(running_server.socket.getsockname(), name=name, group=group, **kwargs)
+        for command, (func, threaded) in (handlers or {}).items():
+            client.on(command, threaded=threaded)(func)
+        client.start()
+        clients.append(client)
+
+        assert wait_for(lambda: len(running_server) == len(clients))
+        return client
+
+    yield connect
+
+    for client in clients:
+        if not client.closed:
+            client.close()
+
+
+class TestComparisons:
+    def test_eq(self, server):
+        assert server == "127.0.0.1:5000"
+        assert not server == "127.0.0.2:5000"
+
+    def test_ordering(self, server):
+        assert server < "127.0.0.2:5000"
+        assert server <= "127.0.0.1:5000"
+        assert server > "127.0.0.0:5000"
+        assert server >= "127.0.0.1:5000"
+
+    def test_hostname_addr(self):
+        server = HiSockServer(("localhost", 0))
+        try:
+            assert server == "127.0.0.1:5000"
+        finally:
+            server.socket.close()
+
+    def test_unsupported_type(self, server):
+        with pytest.raises(TypeError):
+            server < 5
+
+
+class TestClientLookup:
+    @pytest.fixture
+    def renames(self, running_server):
+        renames = []
+
+        @running_server.on("name_change")
+        def on_name_change(client, old_name, new_name):
+            renames.append(new_name)
+
+        @running_server.on("group_change")
+        def on_group_change(client, old_group, new_group):
+            renames.append(new_group)
+
+        return renames
+
+    def test_join(self, running_server, connect):
+        alice = connect("alice", "red")
+        connect("bob", "blue")
+
+        assert running_server.get_client("alice").group == "red"
+        assert running_server.get_client(alice.get_client_addr()).name == "alice"
+        assert [client.name for client in running_server.get_group("blue")] == ["bob"]
+
+    def test_get_all_clients(self, running_server, connect):
+        alice = connect("alice", "red")
+        connect("bob")
+
+        assert [client.name for client in running_server.get_all_clients()] == ["alice", "bob"]
+        assert running_server.get_all_clients("name") == ["alice", "bob"]
+        assert running_server.get_all_clients("group") == ["red", None]
+        assert running_server.get_all_clients("ip")[0] == alice.get_client_addr()
+        assert running_server.get_all_clients("unknown") == []
+
+    def test_not_found(self, running_server, connect):
+        connect("alice", "red")
+
+        with pytest.raises(ClientNotFound):
+            running_server.get_client("bob")
+        with pytest.raises(ClientNotFound):
+            running_server.get_client(("127.0.0.1", 1))
+        with pytest.raises(GroupNotFound):
+            running_server.get_group("blue")
+
+    def test_duplicate_name(self, running_server, connect):
+        first = connect("alice", "red")
+        connect("alice", "blue")
+
+        with pytest.warns(UserWarning):
+            assert running_server.get_client("alice").ip == first.get_client_addr()
+
+        first.close()
+        assert wait_for(lambda: len(running_server) == 1)
+        assert running_server.get_client("alice").group == "blue"
+
+    def test_send_client_not_found(self, server):
+        with pytest.raises(ClientNotFound):
+            server.send_client("bob", "hello")
+        with pytest.raises(ClientNotFound):
+            server.send_client(("127.0.0.1", 1), "hello")
+
+    def test_rename(self, running_server, connect, renames):
+        alice = connect("alice", "red")
+        alice.change_name("carol")
+        assert wait_for(lambda: renames == ["carol"])
+
+        assert running_server.get_client(alice.get_client_addr()).name == "carol"
+        assert running_server.get_client("carol").group == "red"
+        with pytest.raises(ClientNotFound):
+            running_server.get_client("alice")
+
+    def test_rename_without_handler(self, running_server, connect):
+        # `name_change` is optional, and the run loop keeps going afterwards
+        received = []
+
+        @running_server.on("hello")
+        def on_hello(client, message):
+            received.append((client.name, message))
+
+        alice = connect("alice", "red")
+        alice.change_name("carol")
+        alice.send("hello", "world")
+
+        assert wait_for(lambda: received == [("carol", "world")])
+
+    def test_regroup(self, running_server, connect, renames):
+        received = []
+
+        def on_hello(message):
+            received.append(message)
+
+        alice = connect("alice", "red", handlers={"hello": (on_hello, False)})
+        alice.change_group("blue")
+        assert wait_for(lambda: renames == ["blue"])
+
+        assert running_server.get_client("alice").group == "blue"
+        with pytest.raises(GroupNotFound):
+            running_server.get_group("red")
+
+        running_server.send_group("red", "hello", "red")
+        running_server.send_group("blue", "hello", "blue")
+        assert wait_for(lambda: received == ["blue"])
+
+    def test_leave(self, running_server, connect):
+        alice = connect("alice", "red")
+        ip = alice.get_client_addr()
+        alice.close()
+        assert wait_for(lambda: len(running_server) == 0)
+
+        with pytest.raises(ClientNotFound):
+            running_server.get_client("alice")
+        with pytest.raises(ClientNotFound):
+            running_server.get_client(ip)
+        assert not running_server._sockets_by_ip
+        assert not running_server._sockets_by_name
+        assert not running_server._sockets_by_group
+
+    def test_force_disconnect_all(self, running_server, connect):
+        connect("alice", "red")
+        connect("bob", "red")
+        running_server.disconnect_all_clients(force=True)
+
+        assert len(running_server) == 0
+        assert not running_server.clients_rev
+        assert not running_server._sockets_by_ip
+        assert not running_server._sockets_by_name
+        assert not running_server._sockets_by_group
+        # Only the clients are closed, the server keeps accepting
+        assert running_server.socket.fileno() != -1
+        assert set(running_server._selector.get_map()) == {
+            running_server.socket.fileno(),
+            running_server._wakeup_recv.fileno(),
+        }
+
+    def test_client_get_client(self, running_server, connect):
+        alice = connect("alice", "red")
+        bob = connect("bob", "blue")
+
+        assert alice.get_client("bob").group == "blue"
+        assert alice.get_client(bob.get_client_addr()).name == "bob"
+        assert alice.get_client("bob").ip == bob.get_client_addr()
+        with pytest.raises(ClientNotFound):
+            alice.get_client("carol")
+
+    def test_client_get_client_with_recv(self, running_server, connect):
+        # A pending catch-all `recv` doesn't take the response
+        alice = connect("alice", "red")
+        connect("bob", "blue")
+        received = []
+        receiver = threading.Thread(target=lambda: received.append(alice.recv()), daemon=True)
+        receiver.start()
+        assert wait_for(lambda: alice._recv_on_events)
+
+        assert alice.get_client("bob").group == "blue"
+        running_server.send_client("alice", "hello", "hello")
+        receiver.join(5)
+        assert received == ["hello"]
+
+
+class TestCommands:
+    def test_command_starting_with_cmd_letters(self, running_server, connect):
+        # The "$CMD$" prefix is removed as a whole, not as a set of characters
+        received = []
+
+        @running_server.on("Data")
+        def on_data(client, message):
+            received.append(message)
+
+        connect("alice").send("Data", "hello")
+        assert wait_for(lambda: received == ["hello"])
+
+    def test_command_without_content(self, running_server, connect):
+        received = []
+
+        @running_server.on("ping")
+        def on_ping(client, message):
+            received.append(message)
+
+        connect("alice").send("ping")
+        assert wait_for(lambda: received == [None])
+
+    def test_wildcard_and_message(self, running_server, connect):
+        unhandled = []
+        messages = []
+
+        @running_server.on("*")
+        def on_wildcard(client, command, message):
+            unhandled.append((command, message))
+
+        @running_server.on("message")
+        def on_message(client, command, message):
+            messages.append((command, message))
+
+        @running_server.on("handled")
+        def on_handled():
+            pass
+
+        alice = connect("alice")
+        alice.send("unhandled", "hi")
+        alice.send("handled")
+        assert wait_for(lambda: len(messages) == 2)
+        assert unhandled == [("unhandled", "hi")]
+        assert messages == [("unhandled", "hi"), ("handled", None)]
+
+
+    def test_send_all_clients_batch(self, running_server, connect):
+        received = []
+
+        def on_number(message):
+            received.append(message)
+
+        def on_done():
+            received.append("done")
+
+        connect("alice", handlers={"number": (on_number, False), "done": (on_done, False)})
+        running_server.send_all_clients_batch([("number", 1), ("number", 2), ("done", None)])
+        assert wait_for(lambda: received == [1, 2, "done"])
+
+    def test_send_group_batch(self, running_server, connect):
+        received = []
+
+        def on_hello(message):
+            received.append(message)
+
+        connect("alice", "red", handlers={"hello": (on_hello, False)})
+        connect("bob", "blue", handlers={"hello": (on_hello, False)})
+        running_server.send_group_batch("red", [("hello", "one"), ("hello", "two")])
+        assert wait_for(lambda: received == ["one", "two"])
+
+
+class TestCache:
+    def send_messages(self, running_server, connect, cache_size):
+        received = []
+
+        def on_number(message):
+            received.append(message)
+
+        client = connect("alice", cache_size=cache_size, handlers={"number": (on_number, False)})
+        for number in range(5):
+            running_server.send_client("alice", "number", number)
+        assert wait_for(lambda: len(received) == 5)
+        return client
+
+    @staticmethod
+    def cached(cache):
+        return [int(message.content) for message in cache]
+
+    def test_no_cache(self, running_server, connect):
+        client = self.send_messages(running_server, connect, -1)
+        assert not hasattr(client, "cache")
+
+    def test_unlimited_cache(self, running_server, connect):
+        client = self.send_messages(running_server, connect, 0)
+        assert self.cached(client.get_cache()) == [0, 1, 2, 3, 4]
+
+    def test_bounded_cache(self, running_server, connect):
+        client = self.send_messages(running_server, connect, 3)
+        assert self.cached(client.get_cache()) == [2, 3, 4]
+
+    def test_get_cache_index(self, running_server, connect):
+        client = self.send_messages(running_server, connect, 0)
+        assert int(client.get_cache(0).content) == 0
+        assert int(client.get_cache(-1).content) == 4
+
+    def test_get_cache_slice(self, running_server, connect):
+        client = self.send_messages(running_server, connect, 0)
+        assert self.cached(client.get_cache(slice(1, 4))) == [1, 2, 3]
+        assert self.cached(client.get_cache(slice(None, None, 2))) == [0, 2, 4]
+        assert self.cached(client.get_cache(slice(None, None, -1))) == [4, 3, 2, 1, 0]
+        assert self.cached(client.get_cache(slice(-2, None))) == [3, 4]
+
+
+class TestKeepalive:
+    @pytest.fixture
+    def keepalive_server(self):
+        class FastKeepaliveServer(ThreadedHiSockServer):
+            KEEPALIVE_INTERVAL = 0.1
+
+        server = FastKeepaliveServer(("127.0.0.1", 0), keepalive=True)
+        server.start()
+        yield server
+        server.close()
+
+    def test_keepalive(self, keepalive_server):
+        client = ThreadedHiSockClient(keepalive_server.socket.getsockname(), name="alice")
+        client.start()
+        try:
+            # A few rounds of keepalives, the client answers every one of them
+            time.sleep(0.5)
+            assert not client.closed
+            assert keepalive_server.get_client("alice")
+        finally:
+            client.close()
+
+    def test_unresponsive_client(self, keepalive_server):
+        hello = b'$CLTHELLO${"name": "raw", "group": null}'
+        with socket.create_connection(keepalive_server.socket.getsockname(), timeout=5) as raw_client:
+            raw_client.sendall(make_header(hello, keepalive_server.header_len) + hello)
+            assert wait_for(lambda: len(keepalive_server) == 1)
+
+            # The keepalive is framed like every other message
+            join, keepalive = (receive_message(raw_client, keepalive_server.header_len, 8192) for _ in range(2))
+            assert keepalive["data"] == b"$KEEPALIVE$"
+            assert wait_for(lambda: len(keepalive_server) == 0)
+
+
+class TestParallelBroadcasts:
+    @pytest.fixture
+    def running_server(self):
+        server = ThreadedHiSockServer(("127.0.0.1", 0), parallel_broadcasts=True)
+        server.BROADCAST_THREADS = 2
+        server.start()
+        yield server
+        server.close()
+
+    def test_broadcast(self, running_server, connect):
+        received = []
+
+        def on_hello(message):
+            received.append(message)
+
+        for name in ("alice", "bob", "carol"):
+            connect(name, handlers={"hello": (on_hello, False)})
+        running_server.send_all_clients("hello", "world")
+
+        assert wait_for(lambda: received == ["world"] * 3)
+
+    def test_stalled_client(self, running_server):
+        # A client that doesn't read doesn't hold up clients sent to by another thread
+        hello = b'$CLTHELLO${"name": "stalled", "group": null}'
+        stalled = socket.socket()
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(running_server.socket.getsockname())
+        stalled.sendall(make_header(hello, running_server.header_len) + hello)
+        assert wait_for(lambda: len(running_server) == 1)
+
+        received = threading.Event()
+        client = ThreadedHiSockClient(running_server.socket.getsockname(), name="alice")
+        client.on("big")(lambda message: received.set())
+        client.start()
+        assert wait_for(lambda: len(running_server) == 2)
+
+        # Sent to the stalled client first
+        sender = threading.Thread(target=running_server.send_all_clients, args=("big", b"x" * 8_000_000))
+        sender.start()
+        try:
+            assert received.wait(5)
+            assert sender.is_alive()
+        finally:
+            stalled.close()
+            sender.join(5)
+            client.close()
+
+
+class TestSocketOptions:
+    def test_tcp_nodelay(self, running_server, connect):
+        client = connect("alice")
+        server_side = running_server.clients_rev[running_server.get_client("alice")]
+
+        assert client.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert server_side.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+    def test_tcp_nodelay_disabled(self, running_server, connect):
+        client = connect("alice", tcp_nodelay=False)
+        assert not client.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+    @pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT is not supported")
+    def test_reuse_port(self):
+        first = HiSockServer(("127.0.0.1", 0), reuse_port=True)
+        try:
+            second = HiSockServer(first.socket.getsockname(), reuse_port=True)
+            second.close()
+        finally:
+            first.close()
+
+
+class TestClose:
+    def test_close_started_server(self):
+        # Closing the server socket alone doesn't wake up the selector
+        server = ThreadedHiSockServer(("127.0.0.1", 0))
+        server.start()
+        closer = threading.Thread(target=server.close, daemon=True)
+        closer.start()
+        closer.join(5)
+
+        assert not closer.is_alive()
+        assert not server._thread.is_alive()
+        assert server._selector.get_map() is None
+
+    def test_close_unstarted_server(self):
+        server = HiSockServer(("127.0.0.1", 0))
+        server.close()
+        assert server._selector.get_map() is None
+
+
+class TestDisconnect:
+    def test_threaded_force_disconnect(self, running_server, connect):
+        # The client is already closed when its `force_disconnect` runs
+        force_disconnected = threading.Event()
+
+        @running_server.on("kick_me")
+        def on_kick_me(client):
+            running_server.disconnect_client(client)
+
+        def on_force_disconnect():
+            force_disconnected.set()
+
+        client = connect("alice", handlers={"force_disconnect": (on_force_disconnect, True)})
+        client.send("kick_me")
+        assert force_disconnected.wait(5)
+        assert wait_for(lambda: len(running_server) == 0)
+
+    def test_disconnect_message_framed(self, running_server):
+        # A raw socket doesn't leave on its own, so nothing races the disconnection
+        hello = b'$CLTHELLO${"name": "raw", "group": null}'
+        with socket.create_connection(running_server.socket.getsockname(), timeout=5) as raw_client:
+            raw_client.sendall(make_header(hello, running_server.header_len) + hello)
+            assert wait_for(lambda: len(running_server) == 1)
+            running_server.disconnect_client("raw")
+
+            # The join is broadcasted to every client, including the new one
+            join, disconnect = (receive_message(raw_client, running_server.header_len, 8192) for _ in range(2))
+            assert join["data"].startswith(b"$CLTCONN$")
+            assert disconnect["data"] == b"$DISCONN$"
+
+    def test_broken_pipe_in_handler(self, running_server, connect):
+        # Like sending to the client after it reset its connection
+        @running_server.on("break")
+        def on_break():
+            raise BrokenPipeError
+
+        connect("alice").send("break")
+        assert wait_for(lambda: len(running_server) == 0)
+        assert not running_server.closed
+
+    def test_disconnect_all_clients(self, running_server, connect):
+        # Clients leave (on the run loop's thread) while the broadcast is going on
+        force_disconnected = []
+
+        def on_force_disconnect():
+            force_disconnected.append(True)
+
+        for name in ("alice", "bob"):
+            connect(name, handlers={"force_disconnect": (on_force_disconnect, False)})
+
+        running_server.disconnect_all_clients()
+        assert wait_for(lambda: force_disconnected == [True, True])
+        assert wait_for(lambda: len(running_server) == 0)
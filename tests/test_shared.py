@@ -0,0 +1,78 @@
+"""
+Tests the code shared between HiSockServer and HiSockClient
+"""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from hisock._shared import _HandlerThreads, _prepare_contentless_send
+from hisock.utils import make_header
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestHandlerThreads:
+    def test_no_thread_limit(self):
+        # Every call has to be running at the same time for the barrier to pass
+        handler_threads = _HandlerThreads()
+        barrier = threading.Barrier(65, timeout=5)
+        for _ in range(64):
+            handler_threads.submit(barrier.wait, (), {})
+        barrier.wait()
+
+    def test_threads_reused(self):
+        handler_threads = _HandlerThreads()
+        thread_idents = []
+        called = threading.Semaphore(0)
+
+        def record():
+            thread_idents.append(threading.get_ident())
+            called.release()
+
+        handler_threads.submit(record, (), {})
+        assert called.acquire(timeout=5)
+        assert wait_for(lambda: handler_threads._idle == 1)
+
+        handler_threads.submit(record, (), {})
+        assert called.acquire(timeout=5)
+        assert thread_idents[0] == thread_idents[1]
+
+    def test_exception_is_printed(self, capsys):
+        handler_threads = _HandlerThreads()
+        called = threading.Event()
+
+        def fail():
+            raise ValueError("handler failed")
+
+        handler_threads.submit(fail, (), {})
+        handler_threads.submit(called.set, (), {})
+        assert called.wait(5)
+
+        stderr = []
+        assert wait_for(lambda: stderr.append(capsys.readouterr().err) or "handler failed" in "".join(stderr))
+
+    def test_does_not_block_exit(self):
+        script = (
+            "import time\n"
+            "from hisock._shared import _HandlerThreads\n"
+            "_HandlerThreads().submit(time.sleep, (30,), {})\n"
+        )
+        subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).parents[1], timeout=10, check=True)
+
+
+def test_prepare_contentless_send():
+    data = b"$CMD$ping$MSG$" + make_header("", 8)
+    assert _prepare_contentless_send("ping", 16) == make_header(data, 16) + data
+    assert _prepare_contentless_send("ping", 16) is _prepare_contentless_send("ping", 16)
@@ -0,0 +1,42 @@
+"""
+Tests encoding data with its format, and type casting it back
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from hisock import _typecast
+
+
+def round_trip(data):
+    fmt, encoded_data = _typecast.write_fmt(data)
+    return _typecast.typecast_data(_typecast.read_fmt(fmt), encoded_data)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"bytes",
+        "string",
+        3,
+        [1, "a", b"b"],
+        (1, "a"),
+        [1, [2, [3, "nested"]]],
+        {"a": 1, "b": "two"},
+        {"list": [1, 2], "dict": {"c": "d"}},
+    ],
+)
+def test_round_trip(data):
+    assert round_trip(data) == data
+
+
+def test_write_fmt():
+    assert _typecast.write_fmt("hi") == ("2s", b"hi")
+    assert _typecast.write_fmt([1, "a", (2, b"c")]) == ("l1i1s2(1i1b)", b"1a2c")
+    assert _typecast.write_fmt({"a": [1, 2]}) == ("d1s2[1i1i]", b"a12")
+
+
+def test_unsupported_type():
+    with pytest.raises(_typecast.TypecastException):
+        _typecast.write_fmt([None])
@@ -0,0 +1,89 @@
+"""
+Tests the under-the-hood helpers in hisock.utils
+"""
+
+from __future__ import annotations
+
+import socket
+import sys
+import threading
+from dataclasses import replace
+
+import pytest
+
+from hisock.utils import ClientInfo, _json_loads, make_header, receive_message
+
+
+@pytest.fixture
+def sockets():
+    sender, receiver = socket.socketpair()
+    receiver.settimeout(5)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+class TestReceiveMessage:
+    def test_whole_message(self, sockets):
+        sender, receiver = sockets
+        sender.sendall(make_header(b"hello", 16) + b"hello")
+
+        assert receive_message(receiver, 16, 8192) == {"header": make_header(b"hello", 16), "data": b"hello"}
+
+    def test_message_in_parts(self, sockets):
+        # Parts smaller than the buffer size, sent one at a time
+        sender, receiver = sockets
+        data = bytes(range(256)) * 64
+
+        def send_in_parts():
+            sender.sendall(make_header(data, 16))
+            for i in range(0, len(data), 1000):
+                sender.sendall(data[i : i + 1000])
+
+        thread = threading.Thread(target=send_in_parts)
+        thread.start()
+        assert receive_message(receiver, 16, 512)["data"] == data
+        thread.join()
+
+    def test_empty_message(self, sockets):
+        sender, receiver = sockets
+        sender.sendall(make_header(b"", 16))
+
+        assert receive_message(receiver, 16, 8192)["data"] == b""
+
+    def test_disconnected_mid_message(self, sockets):
+        sender, receiver = sockets
+        sender.sendall(make_header(b"hello", 16) + b"he")
+        sender.close()
+
+        assert receive_message(receiver, 16, 8192)["data"] is None
+
+    def test_disconnected(self, sockets):
+        sender, receiver = sockets
+        sender.close()
+
+        assert receive_message(receiver, 16, 8192) is False
+
+
+class TestClientInfo:
+    def test_json_round_trip(self):
+        client_info = ClientInfo(("127.0.0.1", 5000), "alice", "red")
+        assert ClientInfo.from_dict(_json_loads(client_info._json())) == client_info
+
+    def test_json_cached(self):
+        client_info = ClientInfo(("127.0.0.1", 5000), "alice", "red")
+        assert client_info._json() is client_info._json()
+
+    def test_json_after_rename(self):
+        client_info = ClientInfo(("127.0.0.1", 5000), "alice", "red")
+        client_info._json()
+
+        renamed = replace(client_info, name="bob")
+        assert _json_loads(renamed._json())["name"] == "bob"
+        assert renamed == ClientInfo(("127.0.0.1", 5000), "bob", "red")
+        assert hash(renamed) == hash(ClientInfo(("127.0.0.1", 5000), "bob", "red"))
+
+    @pytest.mark.skipif(sys.version_info < (3, 10), reason="dataclass slots need Python 3.10")
+    def test_slots(self):
+        client_info = ClientInfo(("127.0.0.1", 5000), "alice", "red")
+        assert not hasattr(client_info, "__dict__")